@@ -1,139 +1,390 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
-import py3Dmol
-import matplotlib.pyplot as plt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import io
 import asyncio
-import nest_asyncio
 import tempfile
-from Bio.PDB import PDBParser
 import subprocess
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 import glob
+import zlib
+import hashlib
 
 # Import functions from separate files
-from llm import get_llm_response
+from llm import stream_llm_response, parse_llm_output
 from denovo import generate_protein
 
-# Apply patch for asyncio in Streamlit's environment
-nest_asyncio.apply()
-
 st.set_page_config(layout="wide", page_title="Universa AI-Origin")
 
 # ==============================================================================
 # HELPER FUNCTIONS
 # ==============================================================================
 
-def fetch_pdb_from_esmfold(sequence):
-    """Fetches a PDB structure from the ESMFold API."""
-    with st.spinner("Fetching structure from ESMFold..."):
-        try:
-            headers = {"Content-Type": "application/x-www-form-urlencoded"}
-            res = requests.post("https://api.esmatlas.com/foldSequence/v1/pdb/", headers=headers, data=sequence, timeout=120)
-            res.raise_for_status()
-            st.success("✅ Structure generated successfully!")
-            return res.text
-        except requests.exceptions.RequestException as e:
-            st.error(f"Failed to fetch structure from ESMFold: {e}")
-            return None
+@st.cache_resource
+def _event_loop():
+    """Persistent event loop on a daemon thread, shared by all async calls across reruns."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
 
-def relax_protein_structure(pdb_str, settings):
-    """Relaxes a PDB structure using the colabfold_relax command-line tool."""
-    with st.spinner("Relaxing structure with AMBER..."):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            input_path = os.path.join(tmpdir, "input.pdb")
-            with open(input_path, "w") as f:
-                f.write(pdb_str)
-            
-            relax_executable = "/opt/conda/envs/protein_env/bin/colabfold_relax"
-            
-            command = [relax_executable]
-            if settings['use_gpu']:
-                command.append("--use-gpu")
-            
-            command.append(input_path)  
-            command.append(tmpdir)     
+def compress_pdb(pdb_str):
+    """PDB text compresses ~8-10x, so structures are kept zlib-compressed in session state."""
+    return zlib.compress(pdb_str.encode('ascii'), 1)
 
+def decompress_pdb(data):
+    return zlib.decompress(data).decode('ascii')
+
+def put_pdb(key, pdb_str):
+    """Stores a PDB string in session state, compressed."""
+    st.session_state[key] = compress_pdb(pdb_str) if pdb_str else None
+
+def get_pdb(key):
+    """Reads a PDB string stored with put_pdb, or None if unset."""
+    data = st.session_state.get(key)
+    return decompress_pdb(data) if data else None
+
+def iter_async(agen):
+    """Iterates an async generator on the shared event loop, yielding each item to the calling thread."""
+    loop = _event_loop()
+    try:
+        while True:
             try:
-                process = subprocess.run(
-                    command, 
-                    capture_output=True, 
-                    text=True, 
-                    check=True,
-                    timeout=600  
-                )
-                
-                output_files = glob.glob(os.path.join(tmpdir, "*_relaxed_*.pdb"))
-                if not output_files:
-                    st.warning("Relaxation ran, but no relaxed PDB file was found.")
-                    return pdb_str
-                    
-                with open(output_files[0], "r") as f:
-                    relaxed_pdb_str = f.read()
-                st.success("✅ Relaxation complete!")
-                return relaxed_pdb_str
-
-            except subprocess.CalledProcessError as e:
-                st.error("An error occurred during the AMBER relaxation process.")
-                st.text_area("Relaxation Error Log:", e.stderr, height=200)
-                return pdb_str 
-            except Exception as e:
-                st.error(f"An unexpected error occurred during relaxation: {e}")
-                return pdb_str
-            
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+ESMFOLD_URL = "https://api.esmatlas.com/foldSequence/v1/pdb/"
+RELAX_EXECUTABLE = "/opt/conda/envs/protein_env/bin/colabfold_relax"
+RELAX_TIMEOUT = 600
+RELAX_LOG_LINES = 200
+STRUCTURE_POLL_INTERVAL = 2
+# Most unfolded top-scoring candidates a session folds ahead of time alongside the selected sequence
+PREFETCH_LIMIT = 5
+# RAM-backed scratch space for the relax input/output PDBs where available (Linux tmpfs)
+RELAX_TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+@st.cache_resource
+def _esm_session():
+    """Shared session so repeated ESMFold calls reuse the pooled keep-alive connection across reruns."""
+    session = requests.Session()
+    # Retries connection errors and gateway errors only; read timeouts on the long fold call are not replayed
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4, pool_maxsize=16,
+        max_retries=Retry(total=3, read=0, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None),
+    ))
+    return session
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _esmfold_pdb(sequence, _on_progress=None):
+    """Folds a sequence with the ESMFold API. Cached per sequence; raises on failure so errors are not cached.
+
+    The response is streamed and `_on_progress` receives the number of bytes received so far.
+    """
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    buf = bytearray()
+    with _esm_session().post(ESMFOLD_URL, headers=headers, data=sequence, timeout=120, stream=True) as res:
+        res.raise_for_status()
+        for chunk in res.iter_content(chunk_size=65536):
+            buf.extend(chunk)
+            if _on_progress:
+                _on_progress(len(buf))
+    return buf.decode('ascii')
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def _colabfold_relax(pdb_str, max_iterations, tolerance, stiffness, use_gpu, _on_log_line=None, _cancel=None):
+    """Runs colabfold_relax on a PDB string. Returns the relaxed PDB, or None if no output file was produced.
+
+    stderr is streamed line by line to `_on_log_line` and only the last RELAX_LOG_LINES lines are kept.
+    Setting the `_cancel` event kills the process and raises CancelledError.
+    """
+    with tempfile.TemporaryDirectory(dir=RELAX_TMP_DIR) as tmpdir:
+        input_path = os.path.join(tmpdir, "input.pdb")
+        with open(input_path, "w") as f:
+            f.write(pdb_str)
+
+        command = [
+            RELAX_EXECUTABLE,
+            "--max-iterations", str(max_iterations),
+            "--tolerance", str(tolerance),
+            "--stiffness", str(stiffness),
+        ]
+        if use_gpu:
+            command.append("--use-gpu")
+
+        command.append(input_path)
+        command.append(tmpdir)
+
+        log_tail = collections.deque(maxlen=RELAX_LOG_LINES)
+        timed_out, finished = threading.Event(), threading.Event()
+        with subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, bufsize=1) as process:
+            # Reading stderr blocks until the process exits, so timeout and cancellation are enforced by a watchdog
+            def watchdog():
+                deadline = time.monotonic() + RELAX_TIMEOUT
+                while not finished.wait(1):
+                    if _cancel is not None and _cancel.is_set():
+                        return process.kill()
+                    if time.monotonic() > deadline:
+                        timed_out.set()
+                        return process.kill()
+            threading.Thread(target=watchdog, daemon=True).start()
+            try:
+                for line in process.stderr:
+                    log_tail.append(line)
+                    if _on_log_line:
+                        _on_log_line(line)
+                returncode = process.wait()
+            finally:
+                finished.set()
+
+        if _cancel is not None and _cancel.is_set():
+            raise CancelledError()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, RELAX_TIMEOUT, stderr="".join(log_tail))
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr="".join(log_tail))
+
+        output_files = glob.glob(os.path.join(tmpdir, "*_relaxed_*.pdb"))
+        if not output_files:
+            return None
+
+        with open(output_files[0], "r") as f:
+            return f.read()
+
+@st.cache_resource
+def _fold_executor():
+    """Process-wide worker pool for ESMFold requests, shared across reruns and sessions."""
+    return ThreadPoolExecutor(max_workers=8)
+
+@st.cache_resource
+def _prefetch_executor():
+    """Small process-wide pool for speculative folds, so user-requested folds never queue behind them."""
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def _relax_executor():
+    """Process-wide worker pool for relaxation, kept apart so folds never queue behind long relax runs."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def start_folding(sequence):
+    """Submits ESMFold prediction of the sequence to the background pool, then prefetches other candidates."""
+    progress = {'received': 0}
+    st.session_state.fold_progress = progress
+    st.session_state.fold_sequence = sequence
+    # Take over the prefetch for this sequence if it has started; a queued one is cancelled and refolded here
+    pending = dict(st.session_state.prefetch_futures)
+    prefetched = pending.pop(sequence, None)
+    if prefetched is not None and prefetched.cancel():
+        prefetched = None
+    st.session_state.prefetch_futures = pending
+    st.session_state.fold_future = prefetched or _fold_executor().submit(
+        _esmfold_pdb, sequence, _on_progress=lambda n: progress.update(received=n))
+    prefetch_structures(sequence)
+
+def prefetch_structures(sequence):
+    """Folds the top unfolded candidates other than `sequence` on the prefetch pool.
+
+    At most PREFETCH_LIMIT prefetches per session are outstanding at a time; finished ones are
+    picked up by collect_folding.
+    """
+    folded, pending = st.session_state.raw_pdb_dict, st.session_state.prefetch_futures
+    slots = PREFETCH_LIMIT - sum(not future.done() for future in pending.values())
+    candidates = [seq for seq, _ in st.session_state.generated_sequences
+                  if seq != sequence and seq not in folded and seq not in pending]
+    st.session_state.prefetch_futures = {
+        **pending, **{seq: _prefetch_executor().submit(_esmfold_pdb, seq) for seq in candidates[:max(slots, 0)]}}
+
+def cancel_prefetches():
+    """Cancels this session's queued prefetches and forgets the running ones."""
+    for future in st.session_state.prefetch_futures.values():
+        future.cancel()
+    st.session_state.prefetch_futures = {}
+
+def collect_prefetched():
+    """Moves finished prefetched structures into raw_pdb_dict; failed prefetches are dropped."""
+    pending = st.session_state.prefetch_futures
+    done = {seq: future for seq, future in pending.items() if future.done()}
+    if not done:
+        return
+    folded = {seq: compress_pdb(future.result()) for seq, future in done.items()
+              if not future.cancelled() and future.exception() is None}
+    st.session_state.raw_pdb_dict = {**st.session_state.raw_pdb_dict, **folded}
+    st.session_state.prefetch_futures = {seq: future for seq, future in pending.items() if seq not in done}
+
+def collect_folding():
+    """Stores the folded structure once the background prediction has finished and starts relaxation."""
+    collect_prefetched()
+    future = st.session_state.fold_future
+    if future is None or not future.done():
+        return
+    st.session_state.fold_future = None
+    sequence = st.session_state.fold_sequence
+    try:
+        raw_pdb = future.result()
+    except Exception as e:
+        st.error(f"Failed to fetch structure from ESMFold: {e}")
+        return
+    st.success("✅ Structure generated successfully!")
+    st.session_state.raw_pdb = compress_pdb(raw_pdb)
+    st.session_state.raw_pdb_dict = {**st.session_state.raw_pdb_dict, sequence: st.session_state.raw_pdb}
+    start_relaxation(raw_pdb, st.session_state.vis_settings)
+
+RELAX_SETTING_KEYS = ('max_iterations', 'tolerance', 'stiffness', 'use_gpu')
+
+def relax_args(settings):
+    """The relaxation settings passed to _colabfold_relax, in its argument order."""
+    return tuple(settings[k] for k in RELAX_SETTING_KEYS)
+
+def start_relaxation(pdb_str, settings):
+    """Submits AMBER relaxation to the background pool so the raw structure can be shown right away."""
+    log = collections.deque(maxlen=RELAX_LOG_LINES)
+    cancel = threading.Event()
+    st.session_state.relax_log = log
+    st.session_state.relax_cancel = cancel
+    st.session_state.relax_future = _relax_executor().submit(
+        _colabfold_relax, pdb_str, *relax_args(settings), _on_log_line=log.append, _cancel=cancel)
+
+def cancel_structure_jobs():
+    """Cancels this session's pending prediction and relaxation; a running relax process is killed.
+
+    A fold that has already started is kept as a prefetch, so its result still lands in raw_pdb_dict.
+    """
+    fold_future, relax_future = st.session_state.fold_future, st.session_state.relax_future
+    if fold_future is not None and not fold_future.cancel():
+        st.session_state.prefetch_futures = {**st.session_state.prefetch_futures, st.session_state.fold_sequence: fold_future}
+    if relax_future is not None:
+        relax_future.cancel()
+    if st.session_state.relax_cancel is not None:
+        st.session_state.relax_cancel.set()
+    st.session_state.fold_future = st.session_state.relax_future = st.session_state.relax_cancel = None
+
+def collect_relaxation():
+    """Stores the relaxed PDB once the background relaxation has finished."""
+    future = st.session_state.relax_future
+    if future is None or not future.done():
+        return
+    st.session_state.relax_future = None
+    try:
+        relaxed_pdb_str = future.result()
+        if relaxed_pdb_str is None:
+            st.warning("Relaxation ran, but no relaxed PDB file was found.")
+            st.session_state.relaxed_pdb = st.session_state.raw_pdb
+        else:
+            st.success("✅ Relaxation complete!")
+            put_pdb('relaxed_pdb', relaxed_pdb_str)
+
+    except subprocess.CalledProcessError as e:
+        st.error("An error occurred during the AMBER relaxation process.")
+        st.text_area("Relaxation Error Log:", e.stderr, height=200)
+        st.session_state.relaxed_pdb = st.session_state.raw_pdb
+    except Exception as e:
+        st.error(f"An unexpected error occurred during relaxation: {e}")
+        st.session_state.relaxed_pdb = st.session_state.raw_pdb
+
+@st.fragment(run_every=STRUCTURE_POLL_INTERVAL)
+def structure_progress():
+    """Polls the background prediction or relaxation and reruns the app once it is done."""
+    fold_future, relax_future = st.session_state.fold_future, st.session_state.relax_future
+    pending = fold_future or relax_future
+    if pending is None:
+        return
+    if pending.done():
+        st.rerun()
+    if fold_future is not None:
+        received = st.session_state.fold_progress['received']
+        st.info(f"⏳ Fetching structure from ESMFold... {received / 1024:.0f} KB received" if received else "⏳ Fetching structure from ESMFold...")
+    else:
+        log = st.session_state.relax_log
+        last_line = log[-1].strip()[:80] if log else ""
+        st.info(f"⏳ Relaxing structure with AMBER... {last_line}")
+    st.button("Cancel ⏹️", on_click=cancel_structure, help="Stop the running prediction or relaxation.")
+
+# py3Dmol selections and styles used by the structure viewer
+_STYLE_LDDT = {'cartoon': {'colorscheme': {'prop': 'b', 'gradient': 'roygb', 'min': 50, 'max': 90}}}
+_STYLE_RAINBOW = {'cartoon': {'color': 'spectrum'}}
+_STYLE_STICK = {'stick': {'colorscheme': 'WhiteCarbon', 'radius': 0.2}}
+_SEL_BACKBONE = {'atom': ['C', 'O', 'N', 'CA']}
+_SEL_SIDECHAINS = {'resn': ["ALA", "GLY"], 'invert': True}
+
 def view_structure_with_py3dmol(pdb_str, settings):
     """Creates a 3D view of the PDB string using py3Dmol."""
+    import py3Dmol
     view = py3Dmol.view(width=800, height=500)
     view.addModel(pdb_str, 'pdb')
-    if settings['color_scheme'] == "lDDT":
-        view.setStyle({'cartoon': {'colorscheme': {'prop': 'b', 'gradient': 'roygb', 'min': 50, 'max': 90}}})
-    else:
-        view.setStyle({'cartoon': {'color': 'spectrum'}})
+    view.setStyle(_STYLE_LDDT if settings['color_scheme'] == "lDDT" else _STYLE_RAINBOW)
     if settings.get('show_backbone', False):
-        view.addStyle({'atom': ['C', 'O', 'N', 'CA']}, {'stick': {'colorscheme': 'WhiteCarbon', 'radius': 0.2}})
+        view.addStyle(_SEL_BACKBONE, _STYLE_STICK)
     if settings.get('show_sidechains', False):
-        view.addStyle({'resn': ["ALA", "GLY"], 'invert': True}, {'stick': {'colorscheme': 'WhiteCarbon', 'radius': 0.2}})
+        view.addStyle(_SEL_SIDECHAINS, _STYLE_STICK)
     view.setBackgroundColor('#1E1E3F')
     view.zoomTo()
     return view
 
-def plot_plddt_comparison(raw_str, relaxed_str):
-    """Plots a comparison of pLDDT scores for raw and relaxed structures."""
-    def get_b_factors(pdb_str):
-        parser = PDBParser(QUIET=True)
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix=".pdb") as tmp:
-            tmp.write(pdb_str)
-            pdb_path = tmp.name
-        try:
-            structure = parser.get_structure("P", pdb_path)
-            return [atom.get_bfactor() for atom in structure.get_atoms() if atom.get_id() == 'CA']
-        finally:
-            os.remove(pdb_path)
-    
-    fig, ax = plt.subplots(facecolor='#2a2a4e')
+VIEWER_SETTING_KEYS = ('color_scheme', 'show_backbone', 'show_sidechains')
+
+def pdb_digest(pdb_str):
+    """Fast fingerprint of a PDB string (no cryptographic strength needed), used as a cache key in place of the full text."""
+    return hashlib.blake2b(pdb_str.encode('ascii'), digest_size=16).hexdigest()
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _render_py3dmol_html(pdb_key, settings_key, _pdb_str):
+    """Renders the py3Dmol viewer to HTML, cached on `pdb_key` (pdb_digest of `_pdb_str`).
+
+    `settings_key` is a sorted tuple of the viewer settings items.
+    """
+    return view_structure_with_py3dmol(_pdb_str, dict(settings_key))._make_html()
+
+def viewer_settings_key(settings):
+    """Hashable cache key holding only the settings that affect the 3D view."""
+    return tuple(sorted((k, settings.get(k)) for k in VIEWER_SETTING_KEYS))
+
+def get_b_factors(pdb_str):
+    """Returns the CA B-factors (pLDDT for ESMFold output) by slicing the fixed-width PDB columns."""
+    try:
+        columns = [line[60:66] for line in pdb_str.splitlines()
+                   if line.startswith("ATOM") and line[12:16].strip() == "CA"]
+        return np.array(columns, dtype='U6').astype(np.float32)
+    except ValueError:
+        # Not fixed-width; fall back to a full parse. PDBParser keeps per-parse state, so one per call
+        from Bio.PDB import PDBParser
+        structure = PDBParser(QUIET=True).get_structure("P", io.StringIO(pdb_str))
+        return np.array([atom.get_bfactor() for atom in structure.get_atoms() if atom.get_id() == 'CA'], dtype=np.float32)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _plddt_frame(raw_str, relaxed_str):
+    """Per-residue pLDDT scores of the raw and relaxed structures, one column each."""
+    columns = {}
     if raw_str:
-        ax.plot(get_b_factors(raw_str), label="Raw pLDDT", color="#ff7f7f", linewidth=2)
+        columns["Raw pLDDT"] = pd.Series(get_b_factors(raw_str))
     if relaxed_str:
-        ax.plot(get_b_factors(relaxed_str), label="Relaxed pLDDT", color="#33ff33", linestyle="--", linewidth=2)
-    
-    ax.set_title("pLDDT Score Comparison (Raw vs Relaxed)", color='white')
-    ax.set_xlabel("Residue Index", color='white')
-    ax.set_ylabel("pLDDT Score", color='white')
-    ax.legend()
-    ax.grid(True, color='gray', linestyle='--')
-    ax.tick_params(axis='x', colors='white')
-    ax.tick_params(axis='y', colors='white')
-    st.pyplot(fig)
+        columns["Relaxed pLDDT"] = pd.Series(get_b_factors(relaxed_str))
+    return pd.DataFrame(columns)
+
+def plot_plddt_comparison(raw_str, relaxed_str):
+    """Plots a comparison of pLDDT scores for raw and relaxed structures."""
+    df = _plddt_frame(raw_str, relaxed_str)
+    colors = {"Raw pLDDT": "#ff7f7f", "Relaxed pLDDT": "#33ff33"}
+    st.markdown("**pLDDT Score Comparison (Raw vs Relaxed)**")
+    st.line_chart(df, x_label="Residue Index", y_label="pLDDT Score", color=[colors[c] for c in df.columns], height=400)
 
 # ==============================================================================
 # SESSION STATE INITIALIZATION
 # ==============================================================================
 
 DEFAULTS = {
-    'logged_in': False, 'selected_modules': ["Prompt Refinement", "Sequence Generator", "Structure Visualisation"],
-    'auto_mode': True, 'user_prompt': "", 'refined_prompt': "", 'generated_sequences_df': pd.DataFrame(),
+    'logged_in': False, 'mod_refine': True, 'mod_generate': True, 'mod_structure': True,
+    'auto_mode': True, 'user_prompt': "", 'refined_prompt': "", 'generated_sequences': [],
     'selected_sequence': "", 'raw_pdb': None, 'relaxed_pdb': None, 'run_refine': False, 'run_generate': False,
-    'run_structure': False, 'num_sequences': 5,
+    'run_structure': False, 'num_sequences': 5, 'raw_pdb_dict': {},
+    'fold_future': None, 'fold_sequence': None, 'fold_progress': None, 'prefetch_futures': {}, 'relax_future': None, 'relax_cancel': None, 'relax_log': None, '_last_refine_hash': None, '_last_generate_hash': None, '_last_fold_hash': None,
     'vis_settings': {
         'max_iterations': 2000, 'tolerance': 2.39, 'stiffness': 10.0, 'use_gpu': False,
         'color_scheme': 'rainbow', 'display_option': 'Relaxed PDB', 'show_backbone': False, 'show_sidechains': False,
@@ -147,36 +398,222 @@ for key, value in DEFAULTS.items():
 # WORKFLOW LOGIC FUNCTIONS (No changes in this section)
 # ==============================================================================
 
+def input_digest(*parts):
+    """Short digest of a stage's inputs, used to skip re-running a stage with unchanged inputs."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+
 def execute_refine_prompt():
-    st.toast('🚀 Refining prompt...')
-    with st.spinner("Refining prompt with AI..."):
-        st.session_state.refined_prompt = asyncio.run(get_llm_response(st.session_state.user_prompt))
-    if st.session_state.auto_mode and "Sequence Generator" in st.session_state.selected_modules:
+    refine_hash = input_digest(st.session_state.user_prompt)
+    if st.session_state._last_refine_hash != refine_hash or not st.session_state.refined_prompt:
+        st.toast('🚀 Refining prompt...')
+        # Show the reply as it streams in; it is only parsed as JSON once complete
+        placeholder = st.empty()
+        output = ""
+        try:
+            chunks = stream_llm_response(st.session_state.user_prompt)
+            for delta in iter_async(chunks):
+                output += delta
+                placeholder.text(output)
+            st.session_state.refined_prompt = parse_llm_output(output)
+        except Exception as e:
+            st.session_state.refined_prompt = f"Error: {str(e)}"
+        placeholder.empty()
+        # Error replies are not remembered so that the next click retries
+        st.session_state._last_refine_hash = None if st.session_state.refined_prompt.startswith("Error") else refine_hash
+    if st.session_state.auto_mode and st.session_state.mod_generate:
         st.session_state.run_generate = True
 
 def execute_generate_sequence():
-    st.toast('🧬 Generating sequences...')
     prompt_to_use = st.session_state.refined_prompt or st.session_state.user_prompt
-    with st.spinner(f"Generating {st.session_state.num_sequences} protein sequences..."):
-        st.session_state.generated_sequences_df = generate_protein(prompt_to_use, st.session_state.num_sequences)
-    if not st.session_state.generated_sequences_df.empty:
-        st.session_state.selected_sequence = st.session_state.generated_sequences_df.iloc[0]['ProteinSequence']
-    if st.session_state.auto_mode and "Structure Visualisation" in st.session_state.selected_modules:
+    generate_hash = input_digest(prompt_to_use, st.session_state.num_sequences)
+    if st.session_state._last_generate_hash != generate_hash or not st.session_state.generated_sequences:
+        st.toast('🧬 Generating sequences...')
+        with st.spinner(f"Generating {st.session_state.num_sequences} protein sequences..."):
+            df = generate_protein(prompt_to_use, st.session_state.num_sequences)
+        # Prefetches for the previous candidates are no longer useful
+        cancel_prefetches()
+        # Keep only (sequence, score) pairs in session state; the DataFrame is not needed past this point
+        st.session_state.generated_sequences = list(zip(df["ProteinSequence"].tolist(), df["ProtrekScore"].tolist()))
+        if st.session_state.generated_sequences:
+            st.session_state.selected_sequence = st.session_state.generated_sequences[0][0]
+        st.session_state._last_generate_hash = generate_hash
+    if st.session_state.auto_mode and st.session_state.mod_structure:
         st.session_state.run_structure = True
 
 def execute_generate_structure():
+    sequence = st.session_state.selected_sequence
+    # Skip repeated clicks for the structure that is already shown or still being predicted
+    fold_hash = input_digest(sequence, *relax_args(st.session_state.vis_settings))
+    if st.session_state._last_fold_hash == fold_hash and (st.session_state.raw_pdb or st.session_state.fold_future):
+        return
+    st.session_state._last_fold_hash = fold_hash
     st.toast('⚡ Predicting and relaxing structure...')
-    raw_pdb = fetch_pdb_from_esmfold(st.session_state.selected_sequence)
-    st.session_state.raw_pdb = raw_pdb
-    if raw_pdb:
-        st.session_state.relaxed_pdb = relax_protein_structure(raw_pdb, st.session_state.vis_settings)
+    # Prediction and relaxation run in the background; the results panel polls for them
+    folded = st.session_state.raw_pdb_dict.get(sequence)
+    st.session_state.raw_pdb = folded
+    st.session_state.relaxed_pdb = None
+    # Cancel any job still running for a previous sequence
+    cancel_structure_jobs()
+    if folded:
+        start_relaxation(decompress_pdb(folded), st.session_state.vis_settings)
+    else:
+        start_folding(sequence)
+
+def login():
+    if st.session_state.login_user:
+        st.session_state.logged_in = True
+
+def cancel_structure():
+    cancel_structure_jobs()
+    # Forget the cancelled run so the same structure can be requested again
+    st.session_state._last_fold_hash = None
+    st.toast("⏹️ Structure job cancelled.")
 
 def reset_workflow_state():
-    keys_to_reset = ['user_prompt', 'refined_prompt', 'generated_sequences_df', 'selected_sequence', 'raw_pdb', 'relaxed_pdb']
+    cancel_structure_jobs()
+    cancel_prefetches()
+    keys_to_reset = ['user_prompt', 'refined_prompt', 'generated_sequences', 'selected_sequence', 'raw_pdb', 'relaxed_pdb', 'raw_pdb_dict', 'fold_future', 'fold_sequence', 'fold_progress', 'prefetch_futures', 'relax_future', 'relax_cancel', 'relax_log', '_last_refine_hash', '_last_generate_hash', '_last_fold_hash']
     for key in keys_to_reset:
         st.session_state[key] = DEFAULTS.get(key)
     st.toast("✨ Workflow has been reset!")
 
+# ==============================================================================
+# MODULE RENDERING
+# ==============================================================================
+# Each module is a fragment, so interacting with its widgets only reruns that module.
+# Buttons that start a workflow step call st.rerun(), which reruns the whole app.
+
+@st.fragment
+def render_prompt_refinement():
+    with st.container(border=False):
+        st.markdown('<div class="module-container">', unsafe_allow_html=True)
+        st.header("1. Prompt Refinement")
+        left, right = st.columns(2)
+        with left:
+            st.session_state.user_prompt = st.text_area("Enter your protein design idea:", value=st.session_state.user_prompt, height=150, key="prompt_input")
+            if st.button("Refine Prompt"):
+                if st.session_state.user_prompt:
+                    st.session_state.run_refine = True; st.rerun()
+                else:
+                    st.warning("Please enter a prompt first.")
+        with right:
+            st.text_area("AI Refinement Result:", value=st.session_state.refined_prompt, height=190, disabled=True, key="prompt_output", help="The AI-generated prompt will appear here.")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_sequence_generator():
+    with st.container(border=False):
+        st.markdown('<div class="module-container">', unsafe_allow_html=True)
+        left, right = st.columns(2)
+
+        with left:
+            header_cols = st.columns([1, 0.1]); 
+            with header_cols[0]: st.header("2. Sequence Generator")
+            with header_cols[1]:
+                if st.button("⚙️", key="seq_settings_btn", help="Sequence generation settings"):
+                    st.session_state.show_seq_settings = True
+            
+            if st.session_state.get("show_seq_settings", False):
+                @st.dialog("Sequence Generator Settings")
+                def seq_settings_dialog():
+                    st.session_state.num_sequences = st.number_input("Number of sequences to generate", 1, 100, st.session_state.num_sequences)
+                    if st.button("Close", key="close_seq_settings"):
+                        st.session_state.show_seq_settings = False; st.rerun()
+                seq_settings_dialog()
+
+            prompt_for_gen = st.text_area("Prompt for Generator:", value=st.session_state.refined_prompt, height=150, disabled=st.session_state.auto_mode, key="seq_input")
+            if not st.session_state.auto_mode and st.button("Generate Sequences"):
+                if prompt_for_gen:
+                    st.session_state.refined_prompt = prompt_for_gen; st.session_state.run_generate = True; st.rerun()
+                else:
+                    st.warning("Prompt cannot be empty.")
+        with right:
+            st.subheader("Generated Sequences")
+            sequences = st.session_state.generated_sequences
+            if sequences:
+                # No key: the widget id follows the data, so a new generation starts with a fresh selection
+                selection = st.dataframe(
+                    pd.DataFrame(sequences, columns=["ProteinSequence", "ProtrekScore"]),
+                    on_select="rerun", selection_mode="single-row", hide_index=True,
+                    column_order=("ProtrekScore", "ProteinSequence"),
+                    column_config={
+                        "ProtrekScore": st.column_config.NumberColumn("Score", format="%.2f"),
+                        "ProteinSequence": st.column_config.TextColumn("Sequence", width="large"),
+                    },
+                )
+                if selection.selection.rows:
+                    selected_idx = selection.selection.rows[0]
+                    if st.session_state.selected_sequence != sequences[selected_idx][0]:
+                        st.session_state.selected_sequence = sequences[selected_idx][0]
+                        # The structure module shows the selection, so refresh the whole app
+                        if st.session_state.mod_structure:
+                            st.rerun()
+            st.text_area("Selected Sequence:", value=st.session_state.selected_sequence, height=100, disabled=True, key="seq_output")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_structure_visualisation():
+    with st.container(border=False):
+        st.markdown('<div class="module-container">', unsafe_allow_html=True)
+        left, right = st.columns(2)
+
+        with left:
+            header_cols = st.columns([1, 0.1]); 
+            with header_cols[0]: st.header("3. Structure Prediction")
+            with header_cols[1]:
+                if st.button("⚙️", key="relax_settings_btn", help="AMBER Relaxation Settings"):
+                    st.session_state.show_relax_settings = True
+            
+            if st.session_state.get("show_relax_settings", False):
+                @st.dialog("AMBER Relaxation Settings")
+                def relax_settings_dialog():
+                    vis = st.session_state.vis_settings
+                    vis['max_iterations'] = st.slider("Max Iterations", 0, 5000, vis['max_iterations'])
+                    vis['tolerance'] = st.number_input("Tolerance (kcal/mol)", value=vis['tolerance'])
+                    vis['stiffness'] = st.number_input("Stiffness (kcal/mol A²)", value=vis['stiffness'])
+                    vis['use_gpu'] = st.checkbox("Use GPU for relaxation (if available)", value=vis['use_gpu'])
+                    if st.button("Close", key="close_relax_settings"):
+                        st.session_state.show_relax_settings = False; st.rerun()
+                relax_settings_dialog()
+
+            st.session_state.selected_sequence = st.text_area("🧬 Sequence for Prediction:", value=st.session_state.selected_sequence, height=190, key="vis_input")
+            
+            if st.button("🛠️ Generate & Relax Structure"):
+                if st.session_state.selected_sequence:
+                    st.session_state.run_structure = True; st.rerun()
+                else:
+                    st.warning("Please provide a sequence first.")
+
+        with right:
+            st.subheader("Results")
+            if st.session_state.fold_future is not None or st.session_state.relax_future is not None:
+                structure_progress()
+            raw_pdb, relaxed_pdb = get_pdb('raw_pdb'), get_pdb('relaxed_pdb')
+            if raw_pdb:
+                with st.expander("🧪 Visualization Settings"):
+                    vis = st.session_state.vis_settings
+                    vis['display_option'] = st.radio("Display:", ["Raw PDB", "Relaxed PDB"], index=["Raw PDB", "Relaxed PDB"].index(vis['display_option']), horizontal=True)
+                    vis['color_scheme'] = st.selectbox("Color Scheme:", ["rainbow", "lDDT"], index=["rainbow", "lDDT"].index(vis['color_scheme']))
+                    vis['show_backbone'] = st.checkbox("Show Backbone", value=vis['show_backbone'])
+                    vis['show_sidechains'] = st.checkbox("Show Sidechains", value=vis['show_sidechains'])
+
+                pdb_to_show = relaxed_pdb if vis['display_option'] == 'Relaxed PDB' and relaxed_pdb else raw_pdb
+                if pdb_to_show:
+                    html = _render_py3dmol_html(pdb_digest(pdb_to_show), viewer_settings_key(st.session_state.vis_settings), pdb_to_show)
+                    st.components.v1.html(html, height=400, scrolling=False)
+                
+                plot_plddt_comparison(raw_pdb, relaxed_pdb)
+                dl_col1, dl_col2 = st.columns(2)
+                with dl_col1:
+                    st.download_button("Download Raw PDB", raw_pdb, file_name="raw_structure.pdb")
+                with dl_col2:
+                    if relaxed_pdb:
+                        st.download_button("Download Relaxed PDB", relaxed_pdb, file_name="relaxed_structure.pdb")
+            else:
+                st.info("Output will be displayed here after prediction.")
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
 # ==============================================================================
 # UI RENDERING
 # ==============================================================================
@@ -186,16 +623,16 @@ if not st.session_state.logged_in:
     st.markdown('<div class="login-container">', unsafe_allow_html=True)
     st.title("UNIVERSA AI-ORIGIN")
     st.header("AI DRIVEN PROTEIN DESIGN")
-    username = st.text_input("USER NAME", key="login_user")
-    if st.button("LOGIN"):
-        if username:
-            st.session_state.logged_in = True; st.rerun()
-        else:
-            st.error("Username cannot be empty.")
+    st.text_input("USER NAME", key="login_user")
+    # The callback logs in before the rerun the click triggers, so no second st.rerun() is needed
+    if st.button("LOGIN", on_click=login) and not st.session_state.logged_in:
+        st.error("Username cannot be empty.")
     st.markdown('</div>', unsafe_allow_html=True)
 
 else:
     # --- Trigger Handling Logic ---
+    collect_folding()
+    collect_relaxation()
     if st.session_state.run_refine:
         st.session_state.run_refine = False; execute_refine_prompt()
     if st.session_state.run_generate:
@@ -208,122 +645,19 @@ else:
     st.markdown("---")
     st.subheader("Workspace Configuration")
     cols = st.columns(5)
-    selections = {"Prompt Refinement": cols[0].checkbox("Prompt Refinement", value=("Prompt Refinement" in st.session_state.selected_modules)),"Sequence Generator": cols[1].checkbox("Sequence Generator", value=("Sequence Generator" in st.session_state.selected_modules)),"Structure Visualisation": cols[2].checkbox("Structure Visualisation", value=("Structure Visualisation" in st.session_state.selected_modules))}
-    st.session_state.selected_modules = [name for name, selected in selections.items() if selected]
+    # Each checkbox is bound to its own session-state flag (mod_refine, mod_generate, mod_structure)
+    cols[0].checkbox("Prompt Refinement", key="mod_refine")
+    cols[1].checkbox("Sequence Generator", key="mod_generate")
+    cols[2].checkbox("Structure Visualisation", key="mod_structure")
     with cols[3]: st.session_state.auto_mode = st.toggle("Auto Mode", value=st.session_state.auto_mode, help="If active, all selected modules will run automatically in a chain.")
     with cols[4]: st.button("Reset 🔄", on_click=reset_workflow_state, help="Clear all inputs and outputs.")
     st.markdown("---")
 
     # --- Module Rendering with 2-Column Layout ---
-    
-    if "Prompt Refinement" in st.session_state.selected_modules:
-        with st.container(border=False):
-            st.markdown('<div class="module-container">', unsafe_allow_html=True)
-            st.header("1. Prompt Refinement")
-            left, right = st.columns(2)
-            with left:
-                st.session_state.user_prompt = st.text_area("Enter your protein design idea:", value=st.session_state.user_prompt, height=150, key="prompt_input")
-                if st.button("Refine Prompt"):
-                    if st.session_state.user_prompt:
-                        st.session_state.run_refine = True; st.rerun()
-                    else:
-                        st.warning("Please enter a prompt first.")
-            with right:
-                st.text_area("AI Refinement Result:", value=st.session_state.refined_prompt, height=190, disabled=True, key="prompt_output", help="The AI-generated prompt will appear here.")
-            st.markdown('</div>', unsafe_allow_html=True)
-
-    if "Sequence Generator" in st.session_state.selected_modules:
-        with st.container(border=False):
-            st.markdown('<div class="module-container">', unsafe_allow_html=True)
-            left, right = st.columns(2)
-
-            with left:
-                header_cols = st.columns([1, 0.1]); 
-                with header_cols[0]: st.header("2. Sequence Generator")
-                with header_cols[1]:
-                    if st.button("⚙️", key="seq_settings_btn", help="Sequence generation settings"):
-                        st.session_state.show_seq_settings = True
-                
-                if st.session_state.get("show_seq_settings", False):
-                    @st.dialog("Sequence Generator Settings")
-                    def seq_settings_dialog():
-                        st.session_state.num_sequences = st.number_input("Number of sequences to generate", 1, 100, st.session_state.num_sequences)
-                        if st.button("Close", key="close_seq_settings"):
-                            st.session_state.show_seq_settings = False; st.rerun()
-                    seq_settings_dialog()
-
-                prompt_for_gen = st.text_area("Prompt for Generator:", value=st.session_state.refined_prompt, height=150, disabled=st.session_state.auto_mode, key="seq_input")
-                if not st.session_state.auto_mode and st.button("Generate Sequences"):
-                    if prompt_for_gen:
-                        st.session_state.refined_prompt = prompt_for_gen; st.session_state.run_generate = True; st.rerun()
-                    else:
-                        st.warning("Prompt cannot be empty.")
-            with right:
-                st.subheader("Generated Sequences")
-                if not st.session_state.generated_sequences_df.empty:
-                    options = [f"Score {row.ProtrekScore:.2f} - {row.ProteinSequence[:30]}..." for _, row in st.session_state.generated_sequences_df.iterrows()]
-                    selected_option = st.selectbox("Select a sequence:", options, key="seq_selector", label_visibility="collapsed")
-                    if selected_option:
-                        selected_idx = options.index(selected_option)
-                        st.session_state.selected_sequence = st.session_state.generated_sequences_df.iloc[selected_idx]['ProteinSequence']
-                st.text_area("Selected Sequence:", value=st.session_state.selected_sequence, height=100, disabled=True, key="seq_output")
-            st.markdown('</div>', unsafe_allow_html=True)
-
-    if "Structure Visualisation" in st.session_state.selected_modules:
-        with st.container(border=False):
-            st.markdown('<div class="module-container">', unsafe_allow_html=True)
-            left, right = st.columns(2)
-
-            with left:
-                header_cols = st.columns([1, 0.1]); 
-                with header_cols[0]: st.header("3. Structure Prediction")
-                with header_cols[1]:
-                    if st.button("⚙️", key="relax_settings_btn", help="AMBER Relaxation Settings"):
-                        st.session_state.show_relax_settings = True
-                
-                if st.session_state.get("show_relax_settings", False):
-                    @st.dialog("AMBER Relaxation Settings")
-                    def relax_settings_dialog():
-                        vis = st.session_state.vis_settings
-                        vis['max_iterations'] = st.slider("Max Iterations", 0, 5000, vis['max_iterations'])
-                        vis['tolerance'] = st.number_input("Tolerance (kcal/mol)", value=vis['tolerance'])
-                        vis['stiffness'] = st.number_input("Stiffness (kcal/mol A²)", value=vis['stiffness'])
-                        vis['use_gpu'] = st.checkbox("Use GPU for relaxation (if available)", value=vis['use_gpu'])
-                        if st.button("Close", key="close_relax_settings"):
-                            st.session_state.show_relax_settings = False; st.rerun()
-                    relax_settings_dialog()
-
-                st.session_state.selected_sequence = st.text_area("🧬 Sequence for Prediction:", value=st.session_state.selected_sequence, height=190, key="vis_input")
-                
-                if st.button("🛠️ Generate & Relax Structure"):
-                    if st.session_state.selected_sequence:
-                        st.session_state.run_structure = True; st.rerun()
-                    else:
-                        st.warning("Please provide a sequence first.")
-
-            with right:
-                st.subheader("Results")
-                if st.session_state.raw_pdb:
-                    with st.expander("🧪 Visualization Settings"):
-                        vis = st.session_state.vis_settings
-                        vis['display_option'] = st.radio("Display:", ["Raw PDB", "Relaxed PDB"], index=["Raw PDB", "Relaxed PDB"].index(vis['display_option']), horizontal=True)
-                        vis['color_scheme'] = st.selectbox("Color Scheme:", ["rainbow", "lDDT"], index=["rainbow", "lDDT"].index(vis['color_scheme']))
-                        vis['show_backbone'] = st.checkbox("Show Backbone", value=vis['show_backbone'])
-                        vis['show_sidechains'] = st.checkbox("Show Sidechains", value=vis['show_sidechains'])
-
-                    pdb_to_show = st.session_state.relaxed_pdb if vis['display_option'] == 'Relaxed PDB' and st.session_state.relaxed_pdb else st.session_state.raw_pdb
-                    if pdb_to_show:
-                        viewer = view_structure_with_py3dmol(pdb_to_show, st.session_state.vis_settings)
-                        st.components.v1.html(viewer._make_html(), height=400)
-                    
-                    plot_plddt_comparison(st.session_state.raw_pdb, st.session_state.relaxed_pdb)
-                    dl_col1, dl_col2 = st.columns(2)
-                    with dl_col1:
-                        st.download_button("Download Raw PDB", st.session_state.raw_pdb, file_name="raw_structure.pdb")
-                    with dl_col2:
-                        if st.session_state.relaxed_pdb:
-                            st.download_button("Download Relaxed PDB", st.session_state.relaxed_pdb, file_name="relaxed_structure.pdb")
-                else:
-                    st.info("Output will be displayed here after prediction.")
-            
-            st.markdown('</div>', unsafe_allow_html=True)
\ No newline at end of file
+
+    if st.session_state.mod_refine:
+        render_prompt_refinement()
+    if st.session_state.mod_generate:
+        render_sequence_generator()
+    if st.session_state.mod_structure:
+        render_structure_visualisation()
@@ -1,36 +1,52 @@
-from gradio_client import Client
 import pandas as pd
-import re
+import io
 import httpx  
 import streamlit as st 
 
+COLUMNS = ["Index", "LogPPerToken", "ProtrekScore", "ProteinSequence"]
+
+@st.cache_resource(show_spinner=False)
+def _get_denovo_client():
+    # Reused across reruns so the Gradio config fetch and HTTP connection happen once per process
+    from gradio_client import Client
+    return Client("http://www.denovo-pinal.com/")
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_sequences(prompt, num):
+    # Cached per (prompt, num); exceptions propagate so failed requests are not cached
+    client = _get_denovo_client()
+    result = client.predict(
+        input=prompt,
+        designed_num=num,
+        api_name="/design_and_protrek_score"
+    )
+    # Step 1: Keep only the markdown table rows (those whose first cell is the numeric index)
+    rows = (line.strip() for line in result[0].splitlines())
+    table = "\n".join(row for row in rows if row.startswith("|") and row[1:].lstrip()[:1].isdigit())
+    if not table:
+        # Raised rather than returned so a transient server or queue message is not cached
+        raise ValueError("no sequences in Pinal output")
+
+    # Step 2: Parse and type the pipe-delimited rows in one pass with the C parser;
+    # the leading/trailing "|" produce empty edge columns, which usecols drops
+    df = pd.read_csv(io.StringIO(table), sep="|", engine="c", header=None, skipinitialspace=True,
+                     names=["_lead"] + COLUMNS + ["_trail"], usecols=COLUMNS,
+                     dtype={"Index": int, "LogPPerToken": float, "ProtrekScore": float, "ProteinSequence": str})
+    df["ProteinSequence"] = df["ProteinSequence"].str.strip()
+
+    # Step 3: Top `num` rows by ProtrekScore, best first (heap selection instead of a full sort)
+    df = df.nlargest(num, "ProtrekScore").reset_index(drop=True)
+
+    return df
+
 def generate_protein(prompt,num):
     try:
-      client = Client("http://www.denovo-pinal.com/")
-      result = client.predict(
-          input=prompt,
-          designed_num=num,
-          api_name="/design_and_protrek_score"
-        )
-      # Step 1: Extract rows from the markdown table using regex
-      rows = re.findall(r'\|\s*(\d+)\s*\|\s*(-?\d*\.\d+)\s*\|\s*(\d*\.\d+)\s*\|\s*(.*?)\s*\|', result[0])
-
-      # Step 2: Convert to DataFrame
-      df = pd.DataFrame(rows, columns=["Index", "LogPPerToken", "ProtrekScore", "ProteinSequence"])
-
-      # Step 3: Type conversion
-      df["Index"] = df["Index"].astype(int)
-      df["LogPPerToken"] = df["LogPPerToken"].astype(float)
-      df["ProtrekScore"] = df["ProtrekScore"].astype(float)
-      df = df.sort_values(by="ProtrekScore", ascending=False)
-      df = df.reset_index(drop=True)
-
-      return df
+      return _fetch_sequences(prompt, num)
     
     except httpx.ReadTimeout:
         st.error("Connection to sequence generation server (denovo-pinal.com) timed out. The server is likely down or very slow. Please try again later.")
-        return pd.DataFrame() 
+        return pd.DataFrame(columns=COLUMNS) 
 
     except Exception as e:
         st.error(f"An unexpected error occurred with the sequence generator: {e}")
-        return pd.DataFrame() 
\ No newline at end of file
+        return pd.DataFrame(columns=COLUMNS) 
\ No newline at end of file
@@ -1,17 +1,30 @@
 import asyncio
-import json
+import functools
 import os
+import re
+import orjson
 from dotenv import load_dotenv
-from mistralai import Mistral
 
 load_dotenv()
 api_key = os.getenv("MISTRAL_KEY")
 
-async def get_llm_response(user_inputs):
+# Outermost {...} block, for replies that wrap the JSON in extra text or code fences
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    # Created lazily and reused so connection pooling and keep-alive apply across calls
+    from mistralai import Mistral
+    return Mistral(api_key=api_key)
+
+def stream_llm_response(user_inputs):
+    """Returns an async iterator over the raw model output as it streams in."""
     if not api_key:
         raise ValueError("MISTRAL_KEY is missing. Please set up your API key in .env.")
+    return _stream_chunks(user_inputs)
 
-    client = Mistral(api_key=api_key)
+async def _stream_chunks(user_inputs):
+    client = _get_client()
     model = "mistral-small"
 
     system_message = """
@@ -37,31 +50,26 @@ async def get_llm_response(user_inputs):
     messages = [{"role": "system", "content": system_message}]
     for user_text in user_inputs:
         messages.append({"role": "user", "content": user_text})
-    #print("\n"*5)
-    #print(messages)
-    #print("="*100)
-
 
     # Send chat completion request to Model
+    response = await client.chat.stream_async(model=model, messages=messages)
+    async for chunk in response:
+        delta = chunk.data.choices[0].delta
+        if delta and delta.content:
+            yield delta.content
+
+def parse_llm_output(output):
+    """Extracts the refined prompt from the model's JSON output."""
     try:
-        response = await client.chat.stream_async(model=model, messages=messages)
+        try:
+            json_output = orjson.loads(output.strip())
+        except orjson.JSONDecodeError:
+            match = _JSON_OBJECT_RE.search(output)
+            if not match:
+                raise
+            json_output = orjson.loads(match.group(0))
 
-        # Accumulate streamed content
-        output = ""
-        async for chunk in response:
-            delta = chunk.data.choices[0].delta
-            if delta and delta.content:
-                output += delta.content  # Preserve spacing
-
-        # Parse response into JSON
-        json_output = json.loads(output)
-
-        print(json_output)
         return json_output.get("response", output.strip())
-    
-
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return "Error: Invalid response format, possibly due to rate limits."
-    except Exception as e:
-        return f"Error: {str(e)}"